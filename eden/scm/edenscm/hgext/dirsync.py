@@ -42,6 +42,7 @@ create a rule for the subdirectory and prefix it with "exclude":
 
 from __future__ import absolute_import
 
+import bisect
 import errno
 
 import bindings
@@ -64,9 +65,15 @@ from edenscm.mercurial.node import bin
 
 testedwith = "ships-with-fb-hgext"
 EXCLUDE_PATHS = "exclude"
+# characters that make a mirror path a glob pattern for treematcher
+_globchars = set("*?[]{}!\\")
 
 _disabled = [False]
-_nodemirrored = {}  # {node: {path}}, for syncing from commit to wvfs
+# {node: frozenset([path])}, for syncing from commit to wvfs. Only recent
+# commits are consulted, so keep it bounded for long-running processes.
+_nodemirrored = util.lrucachedict(16)
+# {(.hgdirsync content, dirsync config items): (maps, matcher, trie)}
+_configcache = util.lrucachedict(32)
 
 
 def extsetup(ui):
@@ -140,19 +147,48 @@ def getconfigs(wctx):
     """returns {name: [path]}.
     [path] under a same name are synced. name is not useful.
     """
+    return _getcachedconfigs(wctx)[0]
+
+
+def _getcachedconfigs(wctx):
+    """returns (maps, matcher, trie) where maps is the return value of
+    getconfigs(), matcher is configstomatcher(maps) and trie is
+    getmirrortrie(maps).
+
+    The result is cached by the .hgdirsync content and the dirsync config, so
+    rewriting a stack of commits does not parse the same config repeatedly.
+    """
     # read from .hgdirsync in repo
     filename = ".hgdirsync"
     try:
         content = pycompat.decodeutf8(wctx[filename].data())
     except (error.ManifestLookupError, IOError, AttributeError, KeyError):
         content = ""
+    repo = wctx.repo()
+    uiitems = tuple(repo.ui.configitems("dirsync"))
+    key = (content, uiitems)
+    cached = _configcache.get(key)
+    if cached is not None:
+        return cached
+
+    maps = _parseconfigs(content, uiitems)
+    if maps:
+        result = (maps, configstomatcher(maps), getmirrortrie(maps))
+    else:
+        result = (maps, None, None)
+    _configcache[key] = result
+    return result
+
+
+def _parseconfigs(content, uiitems):
+    """parse .hgdirsync content and [dirsync] config items into {name: [path]}"""
+    filename = ".hgdirsync"
     cfg = config.config()
     if content:
         cfg.parse(filename, "[dirsync]\n%s" % content, ["dirsync"])
 
     maps = util.sortdict()
-    repo = wctx.repo()
-    for key, value in repo.ui.configitems("dirsync") + cfg.items("dirsync"):
+    for key, value in list(uiitems) + cfg.items("dirsync"):
         if "." not in key:
             continue
         name, disambig = key.split(".", 1)
@@ -170,13 +206,38 @@ def configstomatcher(configs):
 
     configs is the return value of getconfigs()
     """
-    rules = set()
-    for mirrors in configs.values():
-        for mirror in mirrors:
+    mirrors = set()
+    for dirs in configs.values():
+        for mirror in dirs:
             assert mirror.endswith("/"), "getconfigs() ensures this"
-            rules.add("%s**" % mirror)
-    m = bindings.pathmatcher.treematcher(sorted(rules))
-    return m
+            mirrors.add(mirror)
+    if any(_globchars.intersection(mirror) or mirror[0] == "/" for mirror in mirrors):
+        rules = ["%s**" % mirror for mirror in mirrors]
+        return bindings.pathmatcher.treematcher(sorted(rules))
+    return _prefixmatcher(mirrors)
+
+
+class _prefixmatcher(object):
+    """Match paths under plain directory prefixes ending with "/"
+
+    Equivalent to a treematcher with a "prefix/**" rule for each prefix,
+    without the glob machinery.
+    """
+
+    def __init__(self, prefixes):
+        # Prefixes covered by a shorter prefix are redundant. Dropping them
+        # means only the nearest preceding prefix in sort order can match.
+        self._prefixes = []
+        for prefix in sorted(prefixes):
+            if not self._prefixes or not prefix.startswith(self._prefixes[-1]):
+                self._prefixes.append(prefix)
+
+    def matches(self, path):
+        # "a/**" matches "a" itself, too.
+        path += "/"
+        prefixes = self._prefixes
+        i = bisect.bisect_right(prefixes, path)
+        return i > 0 and path.startswith(prefixes[i - 1])
 
 
 def getmirrors(maps, filename):
@@ -208,6 +269,81 @@ def getmirrors(maps, filename):
     return None, []
 
 
+class _mirrortrie(object):
+    """Prefix tree of mirror directories, keyed by path components.
+
+    lookup(filename) returns the same result as getmirrors(maps, filename),
+    but walks at most the components of filename instead of testing every
+    mirror and exclude rule. lookupdestinations(filename) returns the other
+    mirrors precomputed, for callers that only need those.
+    """
+
+    _excluded = object()
+
+    def __init__(self, maps):
+        # {component: node}, where node is [children, payload]
+        self._root = [{}, None]
+        order = 0
+        for key, mirrordirs in maps.items():
+            for subdir in mirrordirs:
+                if key == EXCLUDE_PATHS:
+                    payload = self._excluded
+                else:
+                    dstmirrors = tuple(m for m in mirrordirs if m != subdir)
+                    payload = (order, subdir, mirrordirs, dstmirrors)
+                    order += 1
+                node = self._root
+                for component in subdir[:-1].split("/"):
+                    node = node[0].setdefault(component, [{}, None])
+                # Exclude rules take precedence. Otherwise the first rule in
+                # config order wins, matching getmirrors().
+                if node[1] is None or payload is self._excluded:
+                    node[1] = payload
+
+    def lookup(self, filename):
+        """Returns (srcmirror, mirrors). See getmirrors()."""
+        best = self._find(filename)
+        if best is None:
+            return None, []
+        return best[1], best[2]
+
+    def lookupdestinations(self, filename):
+        """Returns (srcmirror, dstmirrors).
+
+        dstmirrors are the mirrors filename should be synced to, excluding
+        srcmirror. Returns (None, ()) if filename is not synced.
+        """
+        best = self._find(filename)
+        if best is None:
+            return None, ()
+        return best[1], best[3]
+
+    def _find(self, filename):
+        best = None
+        node = self._root
+        for component in filename.split("/"):
+            node = node[0].get(component)
+            if node is None:
+                break
+            payload = node[1]
+            if payload is None:
+                continue
+            if payload is self._excluded:
+                return None
+            if best is None or payload[0] < best[0]:
+                best = payload
+        return best
+
+
+def getmirrortrie(maps):
+    """returns an object whose lookup(filename) method is equivalent to
+    getmirrors(maps, filename)
+
+    maps is the return value of getconfigs()
+    """
+    return _mirrortrie(maps)
+
+
 def _mctxstatus(ctx, matcher=None):
     """Figure out what has changed that need to be synced
 
@@ -297,7 +433,7 @@ def dirsyncctx(ctx, matcher=None):
 
     This function does not change working copy or dirstate.
     """
-    maps = getconfigs(ctx)
+    maps, needsync, trie = _getcachedconfigs(ctx)
     resultmirrored = set()
     resultctx = ctx
 
@@ -307,96 +443,109 @@ def dirsyncctx(ctx, matcher=None):
     if not maps or (ctx.mutinfo() or {}).get("mutop") == "metaedit":
         return resultctx, resultmirrored
 
-    needsync = configstomatcher(maps)
     repo = ctx.repo()
     mctx, status = _mctxstatus(ctx)
 
+    # Filter the changed paths before doing any per-path work. Most changes
+    # are usually outside dirsync scope.
+    candidates = [
+        (action, path)
+        for action, paths in (
+            ("a", status.added),
+            ("m", status.modified),
+            ("r", status.removed),
+        )
+        for path in paths
+        if needsync.matches(path)
+    ]
+    if matcher is not None:
+        candidates = [(action, path) for action, path in candidates if matcher(path)]
+    if not candidates:
+        return resultctx, resultmirrored
+
     added = set(status.added)
     modified = set(status.modified)
     removed = set(status.removed)
 
-    if matcher is None:
-        matcher = lambda path: True
-
-    for action, paths in (
-        ("a", status.added),
-        ("m", status.modified),
-        ("r", status.removed),
-    ):
-        for src in paths:
-            if not needsync.matches(src) or not matcher(src):
-                continue
-            srcmirror, mirrors = getmirrors(maps, src)
-            if not mirrors:
-                continue
-
-            dstpaths = []  # [(dstpath, dstmirror)]
-            for dstmirror in (m for m in mirrors if m != srcmirror):
-                dst = _mirrorpath(srcmirror, dstmirror, src)
-                dstpaths.append((dst, dstmirror))
+    ui = repo.ui
+    quiet = ui.quiet
+    verbose = ui.verbose
+    mirroredfmts = {
+        "a": _("mirrored adding '%s' to '%s'\n"),
+        "m": _("mirrored changes in '%s' to '%s'\n"),
+        "r": _("mirrored remove of '%s' to '%s'\n"),
+    }
+    unchangedfmts = {
+        "a": _("not mirroring '%s' to '%s'; it already matches\n"),
+        "m": _("not mirroring '%s' to '%s'; it already matches\n"),
+        "r": _("not mirroring remove of '%s' to '%s'; it is already removed\n"),
+    }
+
+    for action, src in candidates:
+        srcmirror, dstmirrors = trie.lookupdestinations(src)
+        if not dstmirrors:
+            continue
 
-            if action == "r":
-                fsrc = None
+        # src is either srcmirror itself (a file to mirror, without the
+        # trailing "/", the suffix is "") or a path under it.
+        srcsuffix = src[len(srcmirror) :]
+        if action == "r":
+            fsrc = None
+            renamed = None
+        else:
+            fsrc = ctx[src]
+            renamed = fsrc.renamed()
+        if renamed:
+            copyfrom, copynode = renamed
+            copysuffix = _mirrorsuffix(srcmirror, copyfrom)
+        for dstmirror in dstmirrors:
+            dst = _mirrorpath(dstmirror, srcsuffix)
+
+            # changed: whether ctx[dst] is changed, according to status.
+            # conflict: whether the dst change conflicts with src change.
+            if dst in removed:
+                conflict, changed = (action != "r"), True
+            elif dst in modified or dst in added:
+                conflict, changed = (fsrc is None or ctx[dst].cmp(fsrc)), True
             else:
-                fsrc = ctx[src]
-            for dst, dstmirror in dstpaths:
-                # changed: whether ctx[dst] is changed, according to status.
-                # conflict: whether the dst change conflicts with src change.
-                if dst in removed:
-                    conflict, changed = (action != "r"), True
-                elif dst in modified or dst in added:
-                    conflict, changed = (fsrc is None or ctx[dst].cmp(fsrc)), True
-                else:
-                    conflict = changed = False
-                if conflict:
-                    raise error.Abort(
-                        _(
-                            "path '%s' needs to be mirrored to '%s', but "
-                            "the target already has pending changes"
-                        )
-                        % (src, dst)
+                conflict = changed = False
+            if conflict:
+                raise error.Abort(
+                    _(
+                        "path '%s' needs to be mirrored to '%s', but "
+                        "the target already has pending changes"
                     )
-                if changed:
-                    if action == "r":
-                        fmt = _(
-                            "not mirroring remove of '%s' to '%s'; it is already removed\n"
-                        )
-                    else:
-                        fmt = _("not mirroring '%s' to '%s'; it already matches\n")
-                    repo.ui.note(fmt % (src, dst))
-                    continue
+                    % (src, dst)
+                )
+            if changed:
+                if verbose:
+                    ui.note(unchangedfmts[action] % (src, dst))
+                continue
 
-                # Mirror copyfrom, too.
-                renamed = fsrc and fsrc.renamed()
-                fmirror = fsrc
-                msg = None
-                if renamed:
-                    copyfrom, copynode = renamed
-                    newcopyfrom = _mirrorpath(srcmirror, dstmirror, copyfrom)
-                    if newcopyfrom:
-                        if action == "a":
-                            msg = _("mirrored copy '%s -> %s' to '%s -> %s'\n") % (
-                                copyfrom,
-                                src,
-                                newcopyfrom,
-                                dst,
-                            )
-                        fmirror = context.overlayfilectx(
-                            fsrc, copied=(newcopyfrom, copynode)
+            # Mirror copyfrom, too.
+            fmirror = fsrc
+            msg = None
+            if renamed and copysuffix is not None:
+                newcopyfrom = _mirrorpath(dstmirror, copysuffix)
+                if newcopyfrom:
+                    if action == "a" and not quiet:
+                        msg = _("mirrored copy '%s -> %s' to '%s -> %s'\n") % (
+                            copyfrom,
+                            src,
+                            newcopyfrom,
+                            dst,
                         )
+                    fmirror = context.overlayfilectx(
+                        fsrc, copied=(newcopyfrom, copynode)
+                    )
 
-                mctx[dst] = fmirror
-                resultmirrored.add(dst)
+            mctx[dst] = fmirror
+            resultmirrored.add(dst)
 
+            if not quiet:
                 if msg is None:
-                    if action == "a":
-                        fmt = _("mirrored adding '%s' to '%s'\n")
-                    elif action == "m":
-                        fmt = _("mirrored changes in '%s' to '%s'\n")
-                    else:
-                        fmt = _("mirrored remove of '%s' to '%s'\n")
-                    msg = fmt % (src, dst)
-                repo.ui.status(msg)
+                    msg = mirroredfmts[action] % (src, dst)
+                ui.status(msg)
 
     if resultmirrored:
         resultctx = mctx
@@ -404,18 +553,29 @@ def dirsyncctx(ctx, matcher=None):
     return resultctx, resultmirrored
 
 
-def _mirrorpath(srcdir, dstdir, src):
-    """Mirror src path from srcdir to dstdir. Return None if src is not in srcdir."""
+def _mirrorsuffix(srcdir, src):
+    """Return the part of src path after srcdir, to be used by _mirrorpath.
+
+    Return "" if src is srcdir itself (a file to mirror), or None if src is
+    not in srcdir.
+    """
     if src + "/" == srcdir:
         # special case: src is a file to mirror
-        return dstdir.rstrip("/")
+        return ""
     elif src.startswith(srcdir):
-        relsrc = src[len(srcdir) :]
-        return dstdir + relsrc
+        return src[len(srcdir) :]
     else:
         return None
 
 
+def _mirrorpath(dstdir, suffix):
+    """Mirror a path to dstdir, given its suffix from _mirrorsuffix()."""
+    if suffix:
+        return dstdir + suffix
+    else:
+        return dstdir.rstrip("/")
+
+
 def _status(ctx1, ctx2):
     """Similar to ctx1.status(ctx2) but remove false positive modifies.
 
@@ -438,7 +598,15 @@ def _status(ctx1, ctx2):
             if path in ctx1 and path in ctx2:
                 f1 = ctx1[path]
                 f2 = ctx2[path]
-                if f1.flags() == f2.flags() and not f1.cmp(f2):
+                if f1.flags() != f2.flags():
+                    newpaths.append(path)
+                    continue
+                # Same filenode, same content. filenode is None for in-memory
+                # files. cmp() checks sizes itself where that is safe.
+                node1 = f1.filenode()
+                if node1 is not None and node1 == f2.filenode():
+                    continue
+                if not f1.cmp(f2):
                     continue
             newpaths.append(path)
     return scmutil.status(newmodified, newadded, status.removed, [], [], [], [])
@@ -453,6 +621,6 @@ def _commitctx(orig, self, ctx, *args, **kwargs):
 
     if mirrored:
         # used by dirsyncfixup to write back from commit to disk
-        _nodemirrored[node] = mirrored
+        _nodemirrored[node] = frozenset(mirrored)
 
     return node
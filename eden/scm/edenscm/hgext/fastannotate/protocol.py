@@ -6,6 +6,7 @@
 # protocol: logic for a server providing fastannotate support
 
 import contextlib
+import errno
 import os
 import sys
 
@@ -16,6 +17,7 @@ from edenscm.mercurial import (
     localrepo,
     pycompat,
     scmutil,
+    util,
     wireproto,
 )
 from edenscm.mercurial.i18n import _
@@ -63,7 +65,7 @@ def _getannotate(repo, proto, path, lastnode):
     # output:
     #   FILE := vfspath + '\0' + str(size) + '\0' + content
     #   OUTPUT := '' | FILE + OUTPUT
-    result = b""
+    parts = []
     buildondemand = repo.ui.configbool("fastannotate", "serverbuildondemand", True)
     with context.annotatecontext(repo, path) as actx:
         if buildondemand:
@@ -89,20 +91,20 @@ def _getannotate(repo, proto, path, lastnode):
         # the lastnode check is not necessary if the client and the server
         # agree where the main branch is.
         if actx.lastnode != lastnode:
+            vfsbaselen = len(repo.localvfs.base + "/")
             for p in [actx.revmappath, actx.linelogpath]:
-                if not os.path.exists(p):
+                try:
+                    with open(p, "rb") as f:
+                        content = f.read()
+                except IOError as ex:
+                    if ex.errno != errno.ENOENT:
+                        raise
                     continue
-                content = b""
-                with open(p, "rb") as f:
-                    content = f.read()
-                vfsbaselen = len(repo.localvfs.base + "/")
-                relpath = p[vfsbaselen:]
-                result += b"%s\0%s\0%s" % (
-                    pycompat.encodeutf8(relpath),
-                    pycompat.encodeutf8(str(len(content))),
-                    content,
-                )
-    return result
+                relpath = pycompat.encodeutf8(p[vfsbaselen:])
+                # avoid quadratic bytes concatenation, join once at the end
+                parts.append(b"%s\0%d\0" % (relpath, len(content)))
+                parts.append(content)
+    return b"".join(parts)
 
 
 def _registerwireprotocommand():
@@ -121,28 +123,22 @@ def serveruisetup(ui):
 
 def _parseresponse(payload):
     result = {}
-    i = 0
-    l = len(payload) - 1
-    state = 0  # 0: vfspath, 1: size
-    vfspath = size = b""
-    while i < l:
-        ch = payload[i : i + 1]
-        if ch == b"\0":
-            if state == 1:
-                sizeint = int(pycompat.decodeutf8(size))
-                buf = buffer(payload)[i + 1 : i + 1 + sizeint]
-                result[pycompat.decodeutf8(vfspath)] = buf
-                i += sizeint
-                state = 0
-                vfspath = size = b""
-            elif state == 0:
-                state = 1
-        else:
-            if state == 1:
-                size += ch
-            elif state == 0:
-                vfspath += ch
-        i += 1
+    view = buffer(payload)
+    pos = 0
+    end = len(payload)
+    while pos < end:
+        # FILE := vfspath + '\0' + str(size) + '\0' + content
+        pathend = payload.find(b"\0", pos)
+        sizeend = payload.find(b"\0", pathend + 1) if pathend >= 0 else -1
+        sizestr = payload[pathend + 1 : sizeend]
+        if sizeend < 0 or not sizestr.isdigit() or sizeend + int(sizestr) >= end:
+            # missing separator, bad size or truncated content
+            raise error.ResponseError(
+                _("unexpected getannotate response:"), bytes(payload[pos:])
+            )
+        vfspath = pycompat.decodeutf8(payload[pos:pathend])
+        pos = sizeend + 1 + int(sizestr)
+        result[vfspath] = view[sizeend + 1 : pos]
     return result
 
 
@@ -165,6 +161,24 @@ def peersetup(ui, peer):
     peer.__class__ = fastannotatepeer
 
 
+# {(ui, remotepath): peer}, peers shared by annotatepeer within a request.
+# Keyed by the ui too, since a peer is set up with the ssh and auth config of
+# the ui that created it. In a long-lived process (chg), later requests come
+# with a new ui.
+_peercache = {}
+
+
+def _closepeer(peer):
+    for i in ["close", "cleanup"]:
+        getattr(peer, i, lambda: None)()
+
+
+def _closecachedpeers(ui):
+    keys = [key for key in _peercache if key[0] is ui]
+    for key in keys:
+        _closepeer(_peercache.pop(key))
+
+
 @contextlib.contextmanager
 def annotatepeer(repo):
     ui = repo.ui
@@ -173,6 +187,7 @@ def annotatepeer(repo):
     fileservice = getattr(repo, "fileservice", None)
     sharepeer = ui.configbool("fastannotate", "clientsharepeer", True)
 
+    cached = False
     if sharepeer and fileservice:
         ui.debug("fastannotate: using remotefilelog connection pool\n")
         conn = repo.connectionpool.get(repo.fallbackpath)
@@ -180,8 +195,20 @@ def annotatepeer(repo):
         stolen = True
     else:
         remotepath = ui.expandpath(ui.config("fastannotate", "remotepath", "default"))
-        peer = hg.peer(ui, {}, remotepath)
         stolen = False
+        if sharepeer:
+            # Reuse the connection for later prefetches in the same request
+            # instead of doing a new handshake each time.
+            cachekey = (ui, remotepath)
+            peer = _peercache.get(cachekey)
+            if peer is None:
+                peer = hg.peer(ui, {}, remotepath)
+                if not any(key[0] is ui for key in _peercache):
+                    ui.atexit(_closecachedpeers, ui)
+                _peercache[cachekey] = peer
+            cached = True
+        else:
+            peer = hg.peer(ui, {}, remotepath)
 
     try:
         # Note: fastannotate requests should never trigger a remotefilelog
@@ -189,12 +216,18 @@ def annotatepeer(repo):
         # that does not exit. See "clientfetch": it does "getannotate" before
         # any hg stuff that could potentially trigger a "getfiles".
         yield peer
+    except BaseException:
+        if cached:
+            # the connection might be in a bad state, do not reuse it
+            if _peercache.get(cachekey) is peer:
+                del _peercache[cachekey]
+            cached = False
+        raise
     finally:
-        if not stolen:
-            for i in ["close", "cleanup"]:
-                getattr(peer, i, lambda: None)()
-        else:
+        if stolen:
             conn.__exit__(None, None, None)
+        elif not cached:
+            _closepeer(peer)
 
 
 def clientfetch(repo, paths, lastnodemap=None, peer=None):
@@ -220,19 +253,24 @@ def clientfetch(repo, paths, lastnodemap=None, peer=None):
     results = list(batcher.results())
 
     ui.debug("fastannotate: server returned\n")
+    entries = []
     for result in results:
         for path, content in pycompat.iteritems(result):
             # ignore malicious paths
             if not path.startswith("fastannotate/") or "/../" in (path + "/"):
                 ui.debug("fastannotate: ignored malicious path %s\n" % path)
                 continue
-            if ui.debugflag:
-                ui.debug(
-                    "fastannotate: writing %d bytes to %s\n" % (len(content), path)
-                )
-            repo.localvfs.makedirs(os.path.dirname(path))
-            with repo.localvfs(path, "wb") as f:
-                f.write(content)
+            entries.append((path, content))
+
+    # revmap and linelog of a file share a directory, create it only once
+    for dirname in sorted({os.path.dirname(path) for path, content in entries}):
+        repo.localvfs.makedirs(dirname)
+    for path, content in entries:
+        if ui.debugflag:
+            ui.debug("fastannotate: writing %d bytes to %s\n" % (len(content), path))
+        # content is a view into the response, write it without copying
+        with repo.localvfs(path, "wb") as f:
+            f.write(content)
 
 
 def _filterfetchpaths(repo, paths):
@@ -247,12 +285,27 @@ def _filterfetchpaths(repo, paths):
 
     if "remotefilelog" in repo.requirements:
         ctx = scmutil.revsingle(repo, master)
+        # Fetch history of all paths in one batch instead of one request per
+        # ancestormap() call below.
+        if util.safehasattr(repo, "fileservice"):
+            try:
+                keys = [
+                    (path, hex(ctx.filenode(path))) for path in paths if path in ctx
+                ]
+                repo.fileservice.prefetch(keys, fetchdata=False, fetchhistory=True)
+            except Exception as ex:
+                repo.ui.debug("fastannotate: history prefetch failed: %r\n" % ex)
         f = lambda path: len(ctx[path].ancestormap())
     else:
+        ctx = None
         f = lambda path: len(repo.file(path))
 
     result = []
     for path in paths:
+        if ctx is not None and path not in ctx:
+            # file not found
+            result.append(path)
+            continue
         try:
             if f(path) >= threshold:
                 result.append(path)
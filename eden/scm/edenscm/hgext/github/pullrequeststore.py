@@ -10,9 +10,10 @@ ML_VERSION_PROPERTY = "version"
 ML_COMMITS_PROPERTY = "commits"
 
 import json
+import struct
 
 from edenscm.mercurial import mutation
-from edenscm.mercurial.node import hex
+from edenscm.mercurial.node import bin, hex
 
 
 class PullRequest:
@@ -30,12 +31,17 @@ class PullRequest:
 class PullRequestStore:
     def __init__(self, repo) -> None:
         self._repo = repo
+        # (blob, decoded pr_data, {binary node: pr}) for the last blob read
+        # from the metalog.
+        self._cached = None
 
     def __str__(self):
         return json.dumps(self._get_pr_data(), indent=2)
 
     def map_commit_to_pull_request(self, node, pull_request: PullRequest):
         pr_data = self._get_pr_data()
+        # pr_data is about to be modified, so it no longer matches the blob.
+        self._cached = None
         commits = pr_data[ML_COMMITS_PROPERTY]
         commits[hex(node)] = {
             "owner": pull_request.owner,
@@ -48,9 +54,9 @@ class PullRequestStore:
             ml.set(METALOG_KEY, blob)
 
     def find_pull_request(self, node):
-        commits = self._get_commits()
+        commits = self._get_commits_by_node()
         for n in mutation.allpredecessors(self._repo, [node]):
-            pr = commits.get(hex(n))
+            pr = commits.get(n)
             if pr:
                 pull_request = PullRequest()
                 pull_request.owner = pr["owner"]
@@ -63,7 +69,15 @@ class PullRequestStore:
         ml = self._repo.metalog()
         blob = ml.get(METALOG_KEY)
         if blob:
-            return decode_pr_data(blob)
+            cached = self._cached
+            if cached is not None and cached[0] == blob:
+                return cached[1]
+            pr_data = decode_pr_data(blob)
+            commits_by_node = {
+                bin(k): v for k, v in pr_data[ML_COMMITS_PROPERTY].items()
+            }
+            self._cached = (blob, pr_data, commits_by_node)
+            return pr_data
         else:
             # Default value for METALOG_KEY.
             return {ML_VERSION_PROPERTY: 1, ML_COMMITS_PROPERTY: {}}
@@ -72,17 +86,62 @@ class PullRequestStore:
         pr_data = self._get_pr_data()
         return pr_data[ML_COMMITS_PROPERTY]
 
+    def _get_commits_by_node(self):
+        """Like _get_commits(), but keyed by binary node."""
+        pr_data = self._get_pr_data()
+        cached = self._cached
+        if cached is not None and cached[1] is pr_data:
+            return cached[2]
+        return {bin(k): v for k, v in pr_data[ML_COMMITS_PROPERTY].items()}
+
 
 """eventually, we will provide a native implementation for encoding/decoding,
 but for now, we will use basic JSON encoding.
+
+Version 1 is plain JSON of the in-memory dict. It is the only version that is
+written, because older clients decode the blob with json.loads() and would
+fail on anything else. Version 2 is only read, so that clients are able to
+decode it before any client starts writing it:
+
+    JSON header {"version": 2, "owners": [...], "names": [...]}
+    b"\\0"
+    one _RECORD per commit: (binary node, owner index, name index, number)
+
+Interning owners and names avoids repeating them (and the dict keys) for
+every commit.
 """
 
+_RECORD = struct.Struct("<20sIII")
+
 
 def encode_pr_data(pr_data: dict) -> bytes:
-    return json.dumps(pr_data).encode("utf8")
+    commits = pr_data[ML_COMMITS_PROPERTY]
+    return json.dumps({ML_VERSION_PROPERTY: 1, ML_COMMITS_PROPERTY: commits}).encode(
+        "utf8"
+    )
 
 
 def decode_pr_data(blob: bytes) -> dict:
-    blob = json.loads(blob)
-    assert isinstance(blob, dict)
-    return blob
+    # JSON never contains a raw NUL, so its absence means version 1.
+    sep = blob.find(b"\0")
+    if sep < 0:
+        blob = json.loads(blob)
+        assert isinstance(blob, dict)
+        return blob
+
+    header = json.loads(blob[:sep])
+    assert isinstance(header, dict)
+    version = header[ML_VERSION_PROPERTY]
+    assert version == 2, "unsupported pull request data version %r" % version
+    owners = header["owners"]
+    names = header["names"]
+    commits = {}
+    for node, owner_idx, name_idx, number in _RECORD.iter_unpack(
+        memoryview(blob)[sep + 1 :]
+    ):
+        commits[hex(node)] = {
+            "owner": owners[owner_idx],
+            "name": names[name_idx],
+            "number": number,
+        }
+    return {ML_VERSION_PROPERTY: version, ML_COMMITS_PROPERTY: commits}
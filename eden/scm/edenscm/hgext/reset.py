@@ -6,8 +6,8 @@
 """reset the active bookmark and working copy to a desired revision"""
 
 import binascii
-import glob
 import os
+import re
 
 from edenscm.mercurial import (
     bundlerepo,
@@ -32,6 +32,8 @@ cmdtable = {}
 command = registrar.command(cmdtable)
 testedwith = "ships-with-fb-hgext"
 
+_hexprefixre = re.compile(r"\A[0-9a-f]{1,40}\Z")
+
 
 @command(
     "reset",
@@ -135,8 +137,20 @@ def _findbundle(repo, rev):
     """
     ui = repo.ui
     backuppath = repo.localvfs.join("strip-backup")
-    backups = list(filter(os.path.isfile, glob.glob(backuppath + "/*.hg")))
-    backups.sort(key=lambda x: os.path.getmtime(x), reverse=True)
+    backups = _listbackups(backuppath)
+    if _hexprefixre.match(rev):
+        # Backup bundles are named after the root of the stripped commits.
+        # Try bundles whose name matches first, since opening a bundle is
+        # expensive, then the rest.
+        def namematches(backup):
+            prefix = os.path.basename(backup).split("-", 1)[0]
+            n = min(len(prefix), len(rev))
+            return prefix[:n] == rev[:n]
+
+        matched = [b for b in backups if namematches(b)]
+        if matched:
+            matchedset = set(matched)
+            backups = matched + [b for b in backups if b not in matchedset]
     for backup in backups:
         # Much of this is copied from the hg incoming logic
         source = os.path.relpath(backup, pycompat.getcwd())
@@ -160,6 +174,25 @@ def _findbundle(repo, rev):
     return None, rev
 
 
+def _listbackups(backuppath):
+    """Returns the paths of backup bundles in backuppath, newest first."""
+    # scandir entries carry their stat result, so each bundle is only
+    # stat-ed once.
+    try:
+        with os.scandir(backuppath) as it:
+            entries = [
+                (entry.stat().st_mtime, entry.path)
+                for entry in it
+                if entry.name.endswith(".hg")
+                and not entry.name.startswith(".")
+                and entry.is_file()
+            ]
+    except OSError:
+        return []
+    entries.sort(key=lambda e: e[0], reverse=True)
+    return [path for mtime, path in entries]
+
+
 def _moveto(repo, bookmark, ctx, clean=False):
     """Moves the given bookmark and the working copy to the given revision.
     By default it does not overwrite the working copy contents unless clean is
@@ -179,19 +212,28 @@ def _moveto(repo, bookmark, ctx, clean=False):
     else:
         # Mark any files that are different between the two as normal-lookup
         # so they show up correctly in hg status afterwards.
-        wctx = repo[None]
-        m1 = wctx.manifest()
+        #
+        # Compare with the working copy parent rather than the working copy
+        # manifest, which needs a full status. Working copy changes are either
+        # non-normal dirstate entries (handled below), or normal entries whose
+        # stat info no longer matches, which status still detects.
+        p1ctx = repo["."]
+        m1 = p1ctx.manifest()
         m2 = ctx.manifest()
         diff = m1.diff(m2)
 
-        changedfiles = []
-        changedfiles.extend(pycompat.iterkeys(diff))
+        # A set, since files changed between the commits are often also
+        # changed in the dirstate.
+        changedfiles = set(diff)
 
         dirstate = repo.dirstate
-        dirchanges = [f for f in dirstate if dirstate[f] != "n"]
-        changedfiles.extend(dirchanges)
+        # Only files in nonnormalset can have a state other than "n". It also
+        # contains normal files needing a check and untracked files.
+        changedfiles.update(
+            f for f in dirstate._map.nonnormalset if dirstate[f] not in ("n", "?")
+        )
 
-        if changedfiles or ctx.node() != repo["."].node():
+        if changedfiles or ctx.node() != p1ctx.node():
             with dirstate.parentchange():
                 dirstate.rebuild(ctx.node(), m2, changedfiles)
 
@@ -212,13 +254,21 @@ def _deleteunreachable(repo, ctx):
     """Deletes all ancestor and descendant commits of the given revision that
     aren't reachable from another bookmark.
     """
+    # Ancestors of a public commit are public, and ancestors of the working
+    # copy parent are kept, so there is nothing to hide.
+    if ctx.phase() == phases.public or ctx.node() == repo.dirstate.p1():
+        return
     keepheads = "bookmark() + ."
     try:
         extensions.find("remotenames")
         keepheads += " + remotenames()"
     except KeyError:
         pass
-    hidenodes = list(repo.nodes("(draft() & ::%n) - ::(%r)", ctx.node(), keepheads))
+    # ::heads(X) is the same set as ::X, but the ancestor walk starts from
+    # fewer commits.
+    hidenodes = list(
+        repo.nodes("(draft() & ::%n) - ::heads(%r)", ctx.node(), keepheads)
+    )
     if hidenodes:
         with repo.lock():
             scmutil.cleanupnodes(repo, hidenodes, "reset")
@@ -30,20 +30,29 @@ static PyObject* blocks(PyObject* self, PyObject* args) {
   PyObject *sa, *sb, *rl = NULL, *m;
   struct bdiff_line *a, *b;
   struct bdiff_hunk l, *h;
-  int an, bn, count, pos = 0;
+  int an, bn, count = -1, pos = 0;
+  const char *pa, *pb;
+  Py_ssize_t la, lb;
+  PyThreadState* _save;
 
   l.next = NULL;
 
   if (!PyArg_ParseTuple(args, "SS:bdiff", &sa, &sb))
     return NULL;
 
-  an = bdiff_splitlines(PyBytes_AsString(sa), PyBytes_Size(sa), &a);
-  bn = bdiff_splitlines(PyBytes_AsString(sb), PyBytes_Size(sb), &b);
+  pa = PyBytes_AsString(sa);
+  la = PyBytes_Size(sa);
+  pb = PyBytes_AsString(sb);
+  lb = PyBytes_Size(sb);
 
-  if (!a || !b)
-    goto nomem;
+  /* sa and sb are kept alive by args */
+  _save = PyEval_SaveThread();
+  an = bdiff_splitlines(pa, la, &a);
+  bn = bdiff_splitlines(pb, lb, &b);
+  if (a && b)
+    count = bdiff_diff(a, an, b, bn, &l);
+  PyEval_RestoreThread(_save);
 
-  count = bdiff_diff(a, an, b, bn, &l);
   if (count < 0)
     goto nomem;
 
@@ -64,6 +73,50 @@ nomem:
   return rl ? rl : PyErr_NoMemory();
 }
 
+/*
+ * Count the bytes of b that are in lines matching a. This is the same as
+ * summing the lengths of lines b1..b2 of each block returned by blocks(a, b),
+ * without building the list of blocks.
+ */
+static PyObject* matchingbytes(PyObject* self, PyObject* args) {
+  PyObject *sa, *sb;
+  struct bdiff_line *a, *b;
+  struct bdiff_hunk l, *h;
+  int an, bn, i, count = -1;
+  const char *pa, *pb;
+  Py_ssize_t la, lb, total = 0;
+  PyThreadState* _save;
+
+  l.next = NULL;
+
+  if (!PyArg_ParseTuple(args, "SS:matchingbytes", &sa, &sb))
+    return NULL;
+
+  pa = PyBytes_AsString(sa);
+  la = PyBytes_Size(sa);
+  pb = PyBytes_AsString(sb);
+  lb = PyBytes_Size(sb);
+
+  /* sa and sb are kept alive by args */
+  _save = PyEval_SaveThread();
+  an = bdiff_splitlines(pa, la, &a);
+  bn = bdiff_splitlines(pb, lb, &b);
+  if (a && b)
+    count = bdiff_diff(a, an, b, bn, &l);
+  if (count >= 0)
+    for (h = l.next; h; h = h->next)
+      for (i = h->b1; i < h->b2; i++)
+        total += b[i].len;
+  PyEval_RestoreThread(_save);
+
+  free(a);
+  free(b);
+  bdiff_freehunks(l.next);
+  if (count < 0)
+    return PyErr_NoMemory();
+  return PyLong_FromSsize_t(total);
+}
+
 static PyObject* bdiff(PyObject* self, PyObject* args) {
   char *sa, *sb, *rb, *ia, *ib;
   PyObject* result = NULL;
@@ -197,6 +250,10 @@ static char mdiff_doc[] = "Efficient binary diff.";
 static PyMethodDef methods[] = {
     {"bdiff", bdiff, METH_VARARGS, "calculate a binary diff\n"},
     {"blocks", blocks, METH_VARARGS, "find a list of matching lines\n"},
+    {"matchingbytes",
+     matchingbytes,
+     METH_VARARGS,
+     "count the bytes of the second text in matching lines\n"},
     {"fixws", fixws, METH_VARARGS, "normalize diff whitespaces\n"},
     {NULL, NULL}};
 
@@ -6,5 +6,6 @@
 from typing import List, Tuple, Union
 
 def blocks(a: str, b: str) -> List[Tuple[int, int, int, int]]: ...
+def matchingbytes(a: bytes, b: bytes) -> int: ...
 def fixws(s: str, allws: bool) -> bytes: ...
 def bdiff(a: Union[str, bytes], b: Union[str, bytes]) -> bytes: ...
@@ -99,6 +99,16 @@ from .i18n import _
 from .node import hex, nullid, short
 
 
+_renamedfromre = re.compile(r"\(renamed from (.+)\)\s*\Z", re.S)
+_removedre = re.compile(r"\A\s*\(removed\)\s*\Z", re.S)
+_renamedorcopiedre = re.compile(r"\A(.*) \((?:renamed|copied) from (.+)\)\s*\Z", re.S)
+
+# comment directives, see the module docstring
+_filere = re.compile(r"^(\w+)/([\w/]+)\s*=\s*(.*)$", re.M)
+_datere = re.compile(r"^(\w+) has date\s*[= ]([0-9 ]+)$", re.M)
+_bookmarkre = re.compile(r"^bookmark (\S+)\s*=\s*(\w+)$", re.M)
+
+
 def _parseasciigraph(text):
     r"""str -> {str : [str]}. convert the ASCII graph to edges
 
@@ -123,9 +133,7 @@ def _parseasciigraph(text):
      'H': ['A'],
      'I': ['H']}
     """
-    # strip comments
-    text = "\n".join(line.split("#", 1)[0] for line in text.splitlines())
-    return bindings.drawdag.parse(text)
+    return bindings.drawdag.parse(text, strip_comments=True)
 
 
 class simplefilectx(object):
@@ -169,11 +177,11 @@ class simplecommitctx(context.committablectx):
         for path, data in filemap.items():
             assert isinstance(data, str)
             # check "(renamed from)". mark the source as removed
-            m = re.search("\(renamed from (.+)\)\s*\Z", data, re.S)
+            m = _renamedfromre.search(data)
             if m:
                 removed.append(m.group(1))
             # check "(removed)"
-            if re.match("\A\s*\(removed\)\s*\Z", data, re.S):
+            if _removedre.match(data):
                 removed.append(path)
             else:
                 if path in removed:
@@ -212,7 +220,7 @@ class simplecommitctx(context.committablectx):
 
     def filectx(self, key):
         data = self._filemap[key]
-        m = re.match("\A(.*) \((?:renamed|copied) from (.+)\)\s*\Z", data, re.S)
+        m = _renamedorcopiedre.match(data)
         if m:
             data = m.group(1)
             renamed = m.group(2)
@@ -234,31 +242,39 @@ def _walkgraph(edges, extraedges):
     -> A to ensure A is created before B.
     """
     visible = set(edges.keys())
-    remaining = {}  # {str: [str]}
+    # Kahn's algorithm. Process nodes level by level, sorted within a level,
+    # so the order is stable and each edge is only visited once.
+    indegree = {}  # {str: int}
+    children = collections.defaultdict(list)  # {str: [str]}
     for k, vs in edges.items():
-        vs = vs[:]
+        vs = set(vs)
         if k in extraedges:
-            vs.extend(list(extraedges[k]))
+            vs.update(extraedges[k])
         for v in vs:
-            if v not in remaining:
-                remaining[v] = []
-        remaining[k] = vs
-    while remaining:
-        leafs = [k for k, v in remaining.items() if not v]
-        if not leafs:
-            raise error.Abort(_("the graph has cycles"))
+            indegree.setdefault(v, 0)
+            children[v].append(k)
+        indegree[k] = len(vs)
+    leafs = [k for k, n in indegree.items() if n == 0]
+    done = 0
+    while leafs:
+        nextleafs = []
         for leaf in sorted(leafs):
             if leaf in visible:
                 yield leaf, edges[leaf]
-            del remaining[leaf]
-            for k, v in remaining.items():
-                if leaf in v:
-                    v.remove(leaf)
+            done += 1
+            for child in children.get(leaf, ()):
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    nextleafs.append(child)
+        leafs = nextleafs
+    if done < len(indegree):
+        raise error.Abort(_("the graph has cycles"))
 
 
-def _getcomments(text):
-    """
-    >>> [s for s in _getcomments(r'''
+def _splitgraph(text):
+    r"""split text into graph edges and comments
+
+    >>> edges, comments = _splitgraph(r'''
     ...        G
     ...        |
     ...  I D C F   # split: B -> E, F, G
@@ -266,13 +282,124 @@ def _getcomments(text):
     ...    H B E   # prune: F, I
     ...     \|/
     ...      A
-    ... ''')]
+    ... ''')
+    >>> comments
     ['split: B -> E, F, G', 'replace: C -> D -> H', 'prune: F, I']
+    >>> sorted(edges)
+    ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I']
     """
+    comments = []
     for line in text.splitlines():
-        if " # " not in line:
+        if " # " in line:
+            comments.append(line.split(" # ", 2)[1].strip())
+    return _parseasciigraph(text), comments
+
+
+def _addbookmarks(repo, tr, namenodes):
+    """add bookmarks in a single change to the bookmark store
+
+    Similar to calling bookmarks.addbookmarks(repo, tr, [name], hex(node),
+    force=True, inactive=True) for each (name, node) in order.
+    """
+    marks = repo._bookmarks
+    changes = []
+    for name, node in namenodes:
+        name = bookmarks.checkformat(repo, name)
+        if name == repo._activebookmark:
+            # addbookmarks only deactivates an active bookmark with inactive=True
+            bookmarks.deactivate(repo)
             continue
-        yield line.split(" # ", 1)[1].split(" # ")[0].strip()
+        for bm in marks.checkconflict(name, True, node):
+            changes.append((bm, None))
+        changes.append((name, node))
+    marks.applychanges(repo, tr, changes)
+
+
+def _parsereplace(cmd, arg, edges, mutations, tohide):
+    """parse "replace: A -> B -> C" (also "rebase" and "amend")"""
+    nodes = [n.strip() for n in arg.split("->")]
+    for i in range(len(nodes) - 1):
+        pred, succ = nodes[i], nodes[i + 1]
+        if succ in mutations:
+            raise error.Abort(
+                _("%s: multiple mutations: from %s and %s")
+                % (succ, pred, mutations[succ][0])
+            )
+        mutations[succ] = ([pred], cmd, None)
+        tohide.add(pred)
+
+
+def _parsesplit(cmd, arg, edges, mutations, tohide):
+    """parse "split: A -> B, C" """
+    pred, succs = arg.split("->")
+    pred = pred.strip()
+    succs = [s.strip() for s in succs.split(",")]
+    for succ in succs:
+        if succ in mutations:
+            raise error.Abort(
+                _("%s: multiple mutations: from %s and %s")
+                % (succ, pred, mutations[succ][0])
+            )
+    for i in range(len(succs) - 1):
+        parent = succs[i]
+        child = succs[i + 1]
+        if child not in edges or parent not in edges[child]:
+            raise error.Abort(
+                _("%s: split targets must be a stack: %s is not a parent of %s")
+                % (pred, parent, child)
+            )
+    mutations[succs[-1]] = ([pred], cmd, succs[:-1])
+    tohide.add(pred)
+
+
+def _parsefold(cmd, arg, edges, mutations, tohide):
+    """parse "fold: A, B -> C" """
+    preds, succ = arg.split("->")
+    preds = [p.strip() for p in preds.split(",")]
+    succ = succ.strip()
+    if succ in mutations:
+        raise error.Abort(
+            _("%s: multiple mutations: from %s and %s")
+            % (succ, ", ".join(preds), mutations[succ][0])
+        )
+    for i in range(len(preds) - 1):
+        parent = preds[i]
+        child = preds[i + 1]
+        if child not in edges or parent not in edges[child]:
+            raise error.Abort(
+                _("%s: fold sources must be a stack: %s is not a parent of %s")
+                % (succ, parent, child)
+            )
+    mutations[succ] = (preds, cmd, None)
+    tohide.update(preds)
+
+
+def _parseprune(cmd, arg, edges, mutations, tohide):
+    """parse "prune: A, B" """
+    for n in arg.split(","):
+        tohide.add(n.strip())
+
+
+def _parserevive(cmd, arg, edges, mutations, tohide):
+    """parse "revive: A, B" """
+    for n in arg.split(","):
+        tohide.discard(n.strip())
+
+
+# {cmd: parse function} for mutation comments like "amend: A -> B -> C"
+#
+# Parse functions add hidden commits to tohide, and record mutations in
+# mutations as {succ: (preds, cmd, split)}. The mutations are also recorded
+# when mutation is disabled, so that invalid comments are rejected either way.
+_mutationparsers = {
+    "replace": _parsereplace,
+    "rebase": _parsereplace,
+    "amend": _parsereplace,
+    "split": _parsesplit,
+    "fold": _parsefold,
+    "prune": _parseprune,
+    "revive": _parserevive,
+}
 
 
 def drawdag(repo, text, **opts):
@@ -297,24 +424,23 @@ def drawdag(repo, text, **opts):
 
 def _drawdagintransaction(repo, text, tr, **opts):
     # parse the graph and make sure len(parents) <= 2 for each node
-    edges = _parseasciigraph(text)
+    edges, comments = _splitgraph(text)
     for k, v in edges.items():
         if len(v) > 2:
             raise error.Abort(_("%s: too many parents: %s") % (k, " ".join(v)))
 
     # parse comments to get extra file content instructions
     files = collections.defaultdict(dict)  # {(name, path): content}
-    comments = list(_getcomments(text))
+    # {content: content}, share identical contents between commits
+    contentpool = {}
     commenttext = "\n".join(comments)
-    filere = re.compile(r"^(\w+)/([\w/]+)\s*=\s*(.*)$", re.M)
-    for name, path, content in filere.findall(commenttext):
+    for name, path, content in _filere.findall(commenttext):
         content = content.replace(r"\n", "\n").replace(r"\1", "\1")
-        files[name][path] = content
+        files[name][path] = contentpool.setdefault(content, content)
 
     # parse commits like "X has date 1 0" to specify dates
     dates = {}
-    datere = re.compile(r"^(\w+) has date\s*[= ]([0-9 ]+)$", re.M)
-    for name, date in datere.findall(commenttext):
+    for name, date in _datere.findall(commenttext):
         dates[name] = date
 
     # do not create default files? (ex. commit A has file "A")
@@ -334,78 +460,21 @@ def _drawdagintransaction(repo, text, tr, **opts):
 
     # parse mutation comments like amend: A -> B -> C
     tohide = set()
+    mutationenabled = mutation.enabled(repo)
     mutations = {}
     for comment in comments:
-        args = comment.split(":", 1)
-        if len(args) <= 1:
+        cmd, sep, arg = comment.partition(":")
+        if not sep:
             continue
-
-        cmd = args[0].strip()
-        arg = args[1].strip()
-
-        if cmd in ("replace", "rebase", "amend"):
-            nodes = [n.strip() for n in arg.split("->")]
-            for i in range(len(nodes) - 1):
-                pred, succ = nodes[i], nodes[i + 1]
-                if succ in mutations:
-                    raise error.Abort(
-                        _("%s: multiple mutations: from %s and %s")
-                        % (succ, pred, mutations[succ][0])
-                    )
-                mutations[succ] = ([pred], cmd, None)
-                tohide.add(pred)
-        elif cmd in ("split",):
-            pred, succs = arg.split("->")
-            pred = pred.strip()
-            succs = [s.strip() for s in succs.split(",")]
-            for succ in succs:
-                if succ in mutations:
-                    raise error.Abort(
-                        _("%s: multiple mutations: from %s and %s")
-                        % (succ, pred, mutations[succ][0])
-                    )
-            for i in range(len(succs) - 1):
-                parent = succs[i]
-                child = succs[i + 1]
-                if child not in edges or parent not in edges[child]:
-                    raise error.Abort(
-                        _("%s: split targets must be a stack: %s is not a parent of %s")
-                        % (pred, parent, child)
-                    )
-            mutations[succs[-1]] = ([pred], cmd, succs[:-1])
-            tohide.add(pred)
-        elif cmd in ("fold",):
-            preds, succ = arg.split("->")
-            preds = [p.strip() for p in preds.split(",")]
-            succ = succ.strip()
-            if succ in mutations:
-                raise error.Abort(
-                    _("%s: multiple mutations: from %s and %s")
-                    % (succ, ", ".join(preds), mutations[succ][0])
-                )
-            for i in range(len(preds) - 1):
-                parent = preds[i]
-                child = preds[i + 1]
-                if child not in edges or parent not in edges[child]:
-                    raise error.Abort(
-                        _("%s: fold sources must be a stack: %s is not a parent of %s")
-                        % (succ, parent, child)
-                    )
-            mutations[succ] = (preds, cmd, None)
-            tohide.update(preds)
-        elif cmd in ("prune",):
-            for n in arg.split(","):
-                n = n.strip()
-                tohide.add(n)
-        elif cmd in ("revive",):
-            for n in arg.split(","):
-                n = n.strip()
-                tohide -= {n}
+        cmd = cmd.strip()
+        parse = _mutationparsers.get(cmd)
+        if parse is not None:
+            parse(cmd, arg.strip(), edges, mutations, tohide)
 
     # Only record mutations if mutation is enabled.
     mutationedges = {}
     mutationpreds = set()
-    if mutation.enabled(repo):
+    if mutationenabled:
         # For mutation recording to work, we must include the mutations
         # as extra edges when walking the DAG.
         for succ, (preds, cmd, split) in mutations.items():
@@ -419,46 +488,70 @@ def _drawdagintransaction(repo, text, tr, **opts):
         mutationedges = {}
         mutations = {}
 
+    # bookmarks to add after committing, [(name, node)]
+    pendingbookmarks = []
+
+    # {node: ctx}, a node is often a parent or predecessor of several commits
+    ctxcache = {}
+
+    def getctx(name):
+        node = committed[name]
+        ctx = ctxcache.get(node)
+        if ctx is None:
+            ctx = ctxcache[node] = repo[node]
+        return ctx
+
     # commit in topological order
+    getfiles = files.get
+    getmutation = mutations.get
+    getdate = dates.get
+    createbookmarks = opts.get("bookmarks")
     for name, parents in _walkgraph(edges, mutationedges):
         if name in committed:
             continue
-        pctxs = [repo[committed[n]] for n in parents]
-        pctxs.sort(key=lambda c: c.node())
+        pctxs = [getctx(n) for n in parents]
+        # Order parents by node. There are at most 2 parents (checked above).
+        if len(pctxs) == 2 and pctxs[1].node() < pctxs[0].node():
+            pctxs.reverse()
         added = {}
         if len(parents) > 1:
             # If it's a merge, take the files and contents from the parents
+            m0 = pctxs[0].manifest()
             for f in pctxs[1].manifest():
-                if f not in pctxs[0].manifest():
-                    added[f] = pycompat.decodeutf8(pctxs[1][f].data())
+                if f not in m0:
+                    content = pycompat.decodeutf8(pctxs[1][f].data())
+                    added[f] = contentpool.setdefault(content, content)
         else:
             # If it's not a merge, add a single file, if defaultfiles is set
             if defaultfiles:
                 added[name] = name
         # add extra file contents in comments
-        for path, content in files.get(name, {}).items():
-            added[path] = content
+        filecontents = getfiles(name)
+        if filecontents:
+            added.update(filecontents)
         commitmutations = None
-        if name in mutations:
-            preds, cmd, split = mutations[name]
+        mutationspec = getmutation(name)
+        if mutationspec is not None:
+            preds, cmd, split = mutationspec
             if split is not None:
-                split = [repo[committed[s]] for s in split]
-            commitmutations = ([repo[committed[p]] for p in preds], cmd, split)
+                split = [getctx(s) for s in split]
+            commitmutations = ([getctx(p) for p in preds], cmd, split)
 
-        date = dates.get(name, "0 0")
+        date = getdate(name, "0 0")
         ctx = simplecommitctx(repo, name, pctxs, added, commitmutations, date)
         n = ctx.commit()
         committed[name] = n
-        if name not in mutationpreds and opts.get("bookmarks"):
-            bookmarks.addbookmarks(repo, tr, [name], hex(n), True, True)
+        if createbookmarks and name not in mutationpreds:
+            pendingbookmarks.append((name, n))
 
     # parse commits like "bookmark book_A=A" to specify bookmarks
     dates = {}
-    bookmarkre = re.compile(r"^bookmark (\S+)\s*=\s*(\w+)$", re.M)
-    for book, name in bookmarkre.findall(commenttext):
+    for book, name in _bookmarkre.findall(commenttext):
         node = committed.get(name)
         if node:
-            bookmarks.addbookmarks(repo, tr, [book], hex(node), True, True)
+            pendingbookmarks.append((book, node))
+    if pendingbookmarks:
+        _addbookmarks(repo, tr, pendingbookmarks)
 
     # update visibility (hide commits)
     hidenodes = [committed[n] for n in tohide]
@@ -466,12 +559,20 @@ def _drawdagintransaction(repo, text, tr, **opts):
 
     del committed[None]
     if opts.get("print"):
-        for name, n in sorted(committed.items()):
-            if name:
-                repo.ui.write("%s %s\n" % (short(n), name))
+        repo.ui.write(
+            "".join(
+                "%s %s\n" % (short(n), name)
+                for name, n in sorted(committed.items())
+                if name
+            )
+        )
     if opts.get("write_env"):
         path = opts.get("write_env")
         with open(path, "w") as f:
-            for name, n in sorted(committed.items()):
-                if name and name not in existed:
-                    f.write("%s=%s\n" % (name, hex(n)))
+            f.write(
+                "".join(
+                    "%s=%s\n" % (name, hex(n))
+                    for name, n in sorted(committed.items())
+                    if name and name not in existed
+                )
+            )
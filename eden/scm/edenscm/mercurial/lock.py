@@ -530,6 +530,12 @@ def islocked(vfs, name):
         return True
 
 
+def rustislocked(vfs, name):
+    """Check whether the rust lock is held without trying to take it"""
+    path = vfs.join(name)
+    return nativelock.pathlock.islocked(vfs.dirname(path), vfs.basename(path))
+
+
 def release(*locks):
     for lock in locks:
         if lock is not None:
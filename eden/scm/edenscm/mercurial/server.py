@@ -17,7 +17,6 @@ import tempfile
 
 from . import chgserver, cmdutil, commandserver, error, hgweb, pycompat, util
 from .i18n import _
-from .pycompat import range
 
 
 def runservice(
@@ -54,13 +53,16 @@ def runservice(
             runargs.append("--daemon-postexec=unlink:%s" % lockpath)
             # Don't pass --cwd to the child process, because we've already
             # changed directory.
-            for i in range(1, len(runargs)):
-                if runargs[i].startswith("--cwd="):
-                    del runargs[i]
-                    break
-                elif runargs[i].startswith("--cwd"):
-                    del runargs[i : i + 2]
-                    break
+            args = iter(runargs[1:])
+            runargs = runargs[:1]
+            for arg in args:
+                if arg.startswith("--cwd="):
+                    continue
+                elif arg.startswith("--cwd"):
+                    # skip the value too
+                    next(args, None)
+                    continue
+                runargs.append(arg)
 
             def condfn():
                 if portpath and not os.path.exists(portpath):
@@ -127,10 +129,10 @@ _cmdservicemap = {
 
 def _createcmdservice(ui, repo, opts):
     mode = opts["cmdserver"]
-    try:
-        return _cmdservicemap[mode](ui, repo, opts)
-    except KeyError:
+    createservice = _cmdservicemap.get(mode)
+    if createservice is None:
         raise error.Abort(_("unknown mode %s") % mode)
+    return createservice(ui, repo, opts)
 
 
 def _createhgwebservice(ui, repo, opts):
@@ -12,8 +12,74 @@
 
 from __future__ import absolute_import
 
-from . import mdiff, progress, pycompat
+import hashlib
+import itertools
+
+from edenscmnative import bdiff
+
+from . import mdiff, progress, util, worker
 from .i18n import _
+from .node import hex
+
+
+# Cache of {filenode: sha1(content)} for removed files, stored as
+# concatenated 20 byte pairs. Filenodes are immutable, so entries never
+# become stale.
+_hashcachefile = "renamehash"
+_hashcacheentrysize = 40
+# Maximum number of entries kept in the cache file
+_hashcachelimit = 100000
+
+
+def _readhashcache(repo):
+    hashes = {}
+    try:
+        data = repo.cachevfs.read(_hashcachefile)
+    except (IOError, OSError):
+        return hashes
+    # ignore a truncated last entry
+    end = len(data) - len(data) % _hashcacheentrysize
+    for i in range(0, end, _hashcacheentrysize):
+        hashes[data[i : i + 20]] = data[i + 20 : i + _hashcacheentrysize]
+    return hashes
+
+
+def _writehashcache(repo, hashes, newfilenodes):
+    """add the digests of newfilenodes to the cache file
+
+    ``hashes`` has all known entries, including the new ones. New entries are
+    appended. The file is only rewritten, keeping the most recently added
+    entries, when it would exceed _hashcachelimit entries or its size shows
+    a partially written entry.
+    """
+    try:
+        size = repo.cachevfs.stat(_hashcachefile).st_size
+    except (IOError, OSError):
+        size = 0
+    try:
+        if (
+            size % _hashcacheentrysize == 0
+            and size // _hashcacheentrysize + len(newfilenodes) <= _hashcachelimit
+        ):
+            # a single write, so concurrent appends do not interleave entries
+            with repo.cachevfs(_hashcachefile, "ab") as f:
+                f.write(b"".join(k + hashes[k] for k in newfilenodes))
+        else:
+            # The file is replaced atomically, so readers never see a partial
+            # write. Concurrent writers may drop each other's new entries,
+            # which only costs hashing those files again.
+            entries = list(hashes.items())[-_hashcachelimit:]
+            with repo.cachevfs(_hashcachefile, "wb", atomictemp=True) as f:
+                f.write(b"".join(k + v for k, v in entries))
+    except (IOError, OSError):
+        pass
+
+
+def _prefetch(repo, fctxs):
+    """fetch the contents of fctxs in one batch if they may be remote"""
+    if fctxs and util.safehasattr(repo, "fileservice"):
+        keys = [(fctx.path(), hex(fctx.filenode())) for fctx in fctxs]
+        repo.fileservice.prefetch(keys, fetchhistory=False)
 
 
 def _findexactmatches(repo, added, removed):
@@ -27,47 +93,121 @@ def _findexactmatches(repo, added, removed):
     with progress.bar(
         repo.ui, _("searching for exact renames"), _("files"), numfiles
     ) as prog:
-        # Build table of removed files: {hash(fctx.data()): [fctx, ...]}.
-        # We use hash() to discard fctx.data() from memory.
-        hashes = {}
+        # Group removed files by size. Files can only be identical if their
+        # sizes match, so most files never need to be read. Like
+        # basefilectx.cmp(), allow for size() not being the data length:
+        # encode filters change the data of working copy files, and filelog
+        # sizes are 4 bytes too large for data starting with "\1\n".
+        filtered = bool(repo._encodefilterpats)
+        bysize = {}
         for fctx in removed:
             prog.value += 1
-            h = hash(fctx.data())
-            if h not in hashes:
-                hashes[h] = [fctx]
-            else:
-                hashes[h].append(fctx)
+            if filtered:
+                bysize.setdefault(None, []).append(fctx)
+                continue
+            size = fctx.size()
+            bysize.setdefault(size, []).append(fctx)
+            if size >= 4:
+                bysize.setdefault(size - 4, []).append(fctx)
+
+        # Removed files with the size of an added file need to be hashed.
+        # Fetch the ones without a cached digest in one batch.
+        addedsizes = [None if filtered else fctx.size() for fctx in added]
+        matchingsizes = bysize.keys() & set(addedsizes)
+        cachedhashes = _readhashcache(repo) if matchingsizes else {}
+        _prefetch(
+            repo,
+            list(
+                {
+                    rfctx.path(): rfctx
+                    for size in matchingsizes
+                    for rfctx in bysize[size]
+                    if rfctx.filenode() not in cachedhashes
+                }.values()
+            ),
+        )
+
+        # {size: {sha1(fctx.data()): [fctx, ...]}}, built lazily for sizes of
+        # added files. The digest lets fctx.data() be discarded from memory.
+        hashesbysize = {}
+        # filenodes whose digests are not in the cache file yet
+        newfilenodes = []
 
         # For each added file, see if it corresponds to a removed file.
-        for fctx in added:
+        for fctx, size in zip(added, addedsizes):
             prog.value += 1
-            adata = fctx.data()
-            h = hash(adata)
-            for rfctx in hashes.get(h, []):
-                # compare between actual file contents for exact identity
-                if adata == rfctx.data():
+            candidates = bysize.get(size)
+            if not candidates:
+                continue
+            hashes = hashesbysize.get(size)
+            if hashes is None:
+                hashes = hashesbysize[size] = {}
+                for rfctx in candidates:
+                    filenode = rfctx.filenode()
+                    h = cachedhashes.get(filenode)
+                    if h is None:
+                        h = hashlib.sha1(rfctx.data()).digest()
+                        if filenode is not None:
+                            cachedhashes[filenode] = h
+                            newfilenodes.append(filenode)
+                    hashes.setdefault(h, []).append(rfctx)
+            for rfctx in hashes.get(hashlib.sha1(fctx.data()).digest(), []):
+                # digests may come from the cache file, so compare between
+                # actual file contents for exact identity
+                if not rfctx.cmp(fctx):
                     yield (rfctx, fctx)
                     break
 
+    if newfilenodes:
+        _writehashcache(repo, cachedhashes, newfilenodes)
+
 
 def _ctxdata(fctx):
     # lazily load text
-    orig = fctx.data()
-    return orig, mdiff.splitnewlines(orig)
+    return _textdata(fctx.data())
+
+
+class _textdata(object):
+    """the content of a file that other files are scored against"""
 
+    def __init__(self, text):
+        self.text = text
 
-def _score(fctx, otherdata):
-    orig, lines = otherdata
-    text = fctx.data()
-    # mdiff.blocks() returns blocks of matching lines
-    # count the number of bytes in each
-    equal = 0
-    matches = mdiff.blocks(text, orig)
-    for x1, x2, y1, y2 in matches:
-        for line in lines[y1:y2]:
-            equal += len(line)
+    @util.propertycache
+    def offsets(self):
+        """offsets[i] is the number of bytes before line i
 
+        Only needed when mdiff.blocks is not bdiff.blocks.
+        """
+        offsets = [0]
+        offsets.extend(itertools.accumulate(map(len, mdiff.splitnewlines(self.text))))
+        return offsets
+
+
+def _score(fctx, otherdata, minscore=0.0):
+    return _scoretext(fctx.data(), otherdata, minscore)
+
+
+def _scoretext(text, otherdata, minscore=0.0):
+    """score text against otherdata, or 0.0 if it cannot beat minscore"""
+    orig = otherdata.text
     lengths = len(text) + len(orig)
+    # matching bytes are counted once and exist in both files, so the sizes
+    # alone can rule out a better score without diffing
+    if minscore and min(len(text), len(orig)) * 2.0 / lengths <= minscore:
+        return 0.0
+    if mdiff.blocks is bdiff.blocks:
+        # count the bytes in matching lines without building the blocks
+        equal = bdiff.matchingbytes(text, orig)
+    else:
+        # mdiff.blocks() returns blocks of matching lines
+        # count the number of bytes in each
+        equal = 0
+        offsets = otherdata.offsets
+        matches = mdiff.blocks(text, orig)
+        for x1, x2, y1, y2 in matches:
+            equal += offsets[y2] - offsets[y1]
+
     return equal * 2.0 / lengths
 
 
@@ -75,31 +215,103 @@ def score(fctx1, fctx2):
     return _score(fctx1, _ctxdata(fctx2))
 
 
+def _scoreremoved(added, threshold, removed):
+    """score removed files against all added files
+
+    ``added`` and ``removed`` are lists of (index, content) for added and
+    removed files. Yields (removed index, added index, score) whenever a pair
+    beats the threshold and the pairs seen before, and (removed index, None,
+    None) after each removed file.
+    """
+    bestscores = {}
+    for ri, orig in removed:
+        data = _textdata(orig)
+        for ai, text in added:
+            bestscore = bestscores.get(ai, threshold)
+            myscore = _scoretext(text, data, bestscore)
+            if myscore > bestscore:
+                bestscores[ai] = myscore
+                yield ri, ai, myscore
+        yield ri, None, None
+
+
+# Maximum total size of added files, and of removed files, whose contents are
+# kept in memory while searching for similar files
+_maxpreloadsize = 64 * 1024 * 1024
+
+
+def _chunks(fctxs, maxsize):
+    """split fctxs into lists of (index, filectx) with at most maxsize bytes
+
+    Every list has at least one file, even if it is larger than maxsize.
+    """
+    chunk = []
+    chunksize = 0
+    for i, fctx in enumerate(fctxs):
+        size = fctx.size()
+        if chunk and chunksize + size > maxsize:
+            yield chunk
+            chunk = []
+            chunksize = 0
+        chunk.append((i, fctx))
+        chunksize += size
+    if chunk:
+        yield chunk
+
+
 def _findsimilarmatches(repo, added, removed, threshold):
     """find potentially renamed files based on similar file content
 
     Takes a list of new filectxs and a list of removed filectxs, and yields
     (before, after, score) tuples of partial matches.
     """
+    if not added or not removed:
+        return
+
+    # Every added file is compared with every removed file. The contents are
+    # read here, in chunks of at most _maxpreloadsize bytes, and the workers
+    # only score them. Removed files are read again for each chunk of added
+    # files.
+    _prefetch(repo, removed)
+    addedchunks = list(_chunks(added, _maxpreloadsize))
+
+    # {added index: (removed index, score)}, the best match of an added file
     copies = {}
+    # {added index: removed index}, where an added file first beat the
+    # threshold. Used to yield matches in a stable order.
+    firstmatch = {}
     with progress.bar(
-        repo.ui, _("searching for similar files"), _("files"), len(removed)
+        repo.ui,
+        _("searching for similar files"),
+        _("files"),
+        len(removed) * len(addedchunks),
     ) as prog:
-        for r in removed:
-            prog.value += 1
+        for addedchunk in addedchunks:
+            addeddata = [(ai, a.data()) for ai, a in addedchunk]
+            for removedchunk in _chunks(removed, _maxpreloadsize):
+                removeddata = [(ri, r.data()) for ri, r in removedchunk]
+                results = worker.worker(
+                    repo.ui,
+                    0.0001 * len(addeddata),
+                    _scoreremoved,
+                    (addeddata, threshold),
+                    removeddata,
+                    callsite="similar",
+                )
+                for ri, ai, myscore in results:
+                    if ai is None:
+                        prog.value += 1
+                        continue
+                    if ri < firstmatch.get(ai, len(removed)):
+                        firstmatch[ai] = ri
+                    # on equal scores, the first removed file wins
+                    best = copies.get(ai)
+                    if best is None or (myscore, -ri) > (best[1], -best[0]):
+                        copies[ai] = (ri, myscore)
 
-            data = None
-            for a in added:
-                bestscore = copies.get(a, (None, threshold))[1]
-                if data is None:
-                    data = _ctxdata(r)
-                myscore = _score(a, data)
-                if myscore > bestscore:
-                    copies[a] = (r, myscore)
-
-    for dest, v in pycompat.iteritems(copies):
-        source, bscore = v
-        yield source, dest, bscore
+    for ai in sorted(copies, key=lambda ai: (firstmatch[ai], ai)):
+        ri, bscore = copies[ai]
+        yield removed[ri], added[ai], bscore
 
 
 def _dropempty(fctxs):
@@ -4888,6 +4888,10 @@ def gcdir(path, mtimethreshold):
 
 
 def spawndetached(args, cwd=None, env=None):
+    if pycompat.islinux and cwd is None:
+        pid = _posixspawndetached(args, env)
+        if pid is not None:
+            return pid
     cmd = bindings.process.Command.new(args[0])
     cmd.args(args[1:])
     if cwd is not None:
@@ -4897,6 +4901,48 @@ def spawndetached(args, cwd=None, env=None):
     return cmd.spawndetached().id()
 
 
+def _posixspawndetached(args, env=None):
+    """spawndetached using posix_spawn
+
+    Unlike the fork used by bindings.process, posix_spawn does not copy the
+    page tables of this process, which is slow for processes using a lot of
+    memory.
+
+    Return None if posix_spawn cannot be used, so the caller can fall back
+    to bindings.process.
+    """
+    try:
+        fdnames = os.listdir("/proc/self/fd")
+    except OSError:
+        # /proc is not mounted
+        return None
+    if env is None:
+        env = os.environ
+    # Like bindings.process, look up the program in the PATH of the new
+    # process, not in ours (which posix_spawnp would do).
+    executable = shutil.which(args[0], path=env.get("PATH", os.defpath))
+    if executable is None:
+        # let bindings.process report the error
+        return None
+    fileactions = [
+        (os.POSIX_SPAWN_OPEN, fd, os.devnull, os.O_RDWR, 0) for fd in (0, 1, 2)
+    ]
+    # Do not leak file descriptors to the new process, like
+    # avoid_inherit_handles in bindings.process.
+    for name in fdnames:
+        fd = int(name)
+        if fd <= 2:
+            continue
+        try:
+            inheritable = os.get_inheritable(fd)
+        except OSError:
+            # the descriptor used to list the directory is closed already
+            continue
+        if inheritable:
+            fileactions.append((os.POSIX_SPAWN_CLOSE, fd))
+    return os.posix_spawn(executable, args, env, file_actions=fileactions, setsid=True)
+
+
 _handlersregistered = False
 _sighandlers = {}
 
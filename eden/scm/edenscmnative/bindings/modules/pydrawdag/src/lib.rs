@@ -12,11 +12,28 @@ use cpython::*;
 pub fn init_module(py: Python, package: &str) -> PyResult<PyModule> {
     let name = [package, "drawdag"].join(".");
     let m = PyModule::new(py, &name)?;
-    m.add(py, "parse", py_fn!(py, parse(text: &str)))?;
+    m.add(
+        py,
+        "parse",
+        py_fn!(py, parse(text: &str, strip_comments: bool = false)),
+    )?;
     Ok(m)
 }
 
-fn parse(_py: Python, text: &str) -> PyResult<BTreeMap<String, Vec<String>>> {
+/// Parse the ASCII graph. If `strip_comments` is true, ignore everything
+/// after "#" on each line.
+fn parse(_py: Python, text: &str, strip_comments: bool) -> PyResult<BTreeMap<String, Vec<String>>> {
+    let stripped: String;
+    let text = if strip_comments {
+        stripped = text
+            .lines()
+            .map(|line| line.split('#').next().unwrap_or(""))
+            .collect::<Vec<_>>()
+            .join("\n");
+        stripped.as_str()
+    } else {
+        text
+    };
     let parsed = drawdag::parse(text);
     let result = parsed
         .into_iter()
@@ -31,6 +31,11 @@ py_class!(class pathlock |py| {
         Self::create_instance(py, Cell::new(Some(vfs.try_lock(&name, contents.as_bytes()).map_pyerr(py)?)))
     }
 
+    @classmethod def islocked(_cls, dir: PyPathBuf, name: String) -> PyResult<bool> {
+        let vfs = vfs::VFS::new(dir.to_path_buf()).map_pyerr(py)?;
+        vfs.is_locked(&name).map_pyerr(py)
+    }
+
     def unlock(&self) -> PyResult<PyNone> {
         if let Some(f) = self.lock(py).replace(None) {
             f.unlock().map_pyerr(py)?;
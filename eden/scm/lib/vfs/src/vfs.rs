@@ -393,6 +393,30 @@ impl VFS {
         Ok(lock_file)
     }
 
+    /// is_locked reports whether the lock acquired by try_lock is
+    /// currently held by anyone, including this process. Unlike
+    /// try_lock, it doesn't create any files or write any contents.
+    pub fn is_locked(&self, name: &str) -> Result<bool, LockError> {
+        let name = sanitize_lock_name(name);
+        let path = self
+            .join(PathComponent::from_str(&name)?.as_ref())
+            .with_extension("lock");
+        let lock_file = match File::open(path) {
+            Ok(f) => f,
+            Err(err) if err.kind() == ErrorKind::NotFound => return Ok(false),
+            Err(err) => return Err(err.into()),
+        };
+
+        match lock_file.try_lock_exclusive() {
+            Ok(_) => {
+                lock_file.unlock()?;
+                Ok(false)
+            }
+            Err(err) if err.kind() == fs2::lock_contended_error().kind() => Ok(true),
+            Err(err) => Err(err.into()),
+        }
+    }
+
     fn lock_dir(&self) -> Result<PathLock, LockError> {
         Ok(PathLock::exclusive(
             self.join(PathComponent::from_str(".dir_lock")?.as_ref()),
@@ -525,6 +549,26 @@ mod unix_tests {
         Ok(())
     }
 
+    #[test]
+    fn test_is_locked() -> Result<()> {
+        let tmp = tempfile::tempdir()?;
+        let vfs = VFS::new(tmp.path().to_path_buf())?;
+
+        assert!(!vfs.is_locked("foo")?);
+
+        {
+            let _foo_lock = vfs.try_lock("foo", "some contents")?;
+            assert!(vfs.is_locked("foo")?);
+        }
+
+        assert!(!vfs.is_locked("foo")?);
+
+        // Probing doesn't leave the lock held.
+        let _foo_lock = vfs.try_lock("foo", "some contents")?;
+
+        Ok(())
+    }
+
     #[test]
     #[cfg(unix)]
     fn test_try_lock_permissions() -> Result<()> {
@@ -28,10 +28,10 @@ try:
     f.write("\n")
 finally:
     f.close()
-inc = 1
-now = os.stat(fname).st_mtime
-while now == before:
-    t = now + inc
-    inc += 1
+if os.stat(fname).st_mtime == before:
+    t = before + 1
     os.utime(fname, (t, t))
-    now = os.stat(fname).st_mtime
+    if os.stat(fname).st_mtime == before:
+        # filesystems like FAT only store even seconds
+        t = before + 2
+        os.utime(fname, (t, t))
@@ -174,3 +174,71 @@ copies here
   recording removal of d/a as rename to c (100% similar)
 
   $ cd ..
+
+Exact renames are found when size() is not the length of the data
+
+  $ hg init rep4; cd rep4
+  $ printf '\1\nstarts like metadata\n' > meta
+  $ hg add meta
+  $ hg commit -m meta
+  $ mv meta meta2
+  $ hg addremove -s100
+  removing meta
+  adding meta2
+  recording removal of meta as rename to meta2 (100% similar)
+  $ hg commit -m 'rename meta'
+
+  $ readconfig <<EOF
+  > [encode]
+  > *.strip = tr -d -
+  > EOF
+  $ echo 'a-b-c' > f.strip
+  $ hg add f.strip
+  $ hg commit -m filtered
+  $ mv f.strip g.strip
+  $ hg addremove -s100
+  removing f.strip
+  adding g.strip
+  recording removal of f.strip as rename to g.strip (100% similar)
+
+  $ cd ..
+
+Similar files are found the same way by worker threads
+
+  $ hg init rep5; cd rep5
+  $ for i in $(seq 1 70); do
+  >   printf 'line %s\n' $i $i $i $i > r$i
+  > done
+  $ hg commit -Aqm removed
+  $ for i in $(seq 1 70); do
+  >   mv r$i a$i
+  >   echo more >> a$i
+  > done
+  $ hg addremove -q -s50 --config worker.enabled=True --config worker.numcpus=8
+  $ hg debugstate | grep -c '^copy: r'
+  70
+  $ hg debugstate | sed -n 's/^copy: r\(.*\) -> a\(.*\)$/\1 \2/p' | awk '$1 != $2'
+
+  $ cd ..
+
+Digests from a bad cache file do not cause false exact renames
+
+  $ hg init rep6; cd rep6
+  $ echo foo > foo
+  $ hg commit -Aqm foo
+  $ FILENODE=`hg manifest --debug | cut -c1-40`
+  $ $PYTHON <<EOF
+  > import binascii, hashlib
+  > with open(".hg/cache/renamehash", "wb") as f:
+  >     f.write(binascii.unhexlify("$FILENODE") + hashlib.sha1(b"bar\n").digest())
+  >     f.write(b"truncated")
+  > EOF
+  $ rm foo
+  $ echo bar > bar
+  $ hg addremove -s100
+  removing foo
+  adding bar
+  $ hg debugstate | grep copy
+  [1]
+
+  $ cd ..
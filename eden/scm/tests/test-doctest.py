@@ -21,22 +21,30 @@ if "TERM" in os.environ:
     del os.environ["TERM"]
 
 
+_unicodere = re.compile(r"""\bu(['"])(.*?)\1""")
+_bytesre = re.compile(r"""\bb(['"])(.*?)\1""")
+_excmsgre = re.compile(r"""^mercurial\.\w+\.(\w+): (['"])(.*?)\2""", re.MULTILINE)
+_excnamere = re.compile(r"^mercurial\.\w+\.(\w+): ", re.MULTILINE)
+
+
 class py3docchecker(doctest.OutputChecker):
     def check_output(self, want, got, optionflags):
-        want2 = re.sub(r"""\bu(['"])(.*?)\1""", r"\1\2\1", want)  # py2: u''
-        got2 = re.sub(r"""\bb(['"])(.*?)\1""", r"\1\2\1", got)  # py3: b''
+        want2 = _unicodere.sub(r"\1\2\1", want)  # py2: u''
+        got2 = _bytesre.sub(r"\1\2\1", got)  # py3: b''
         # py3: <exc.name>: b'<msg>' -> <name>: <msg>
         #      <exc.name>: <others> -> <name>: <others>
-        got2 = re.sub(
-            r"""^mercurial\.\w+\.(\w+): (['"])(.*?)\2""", r"\1: \3", got2, re.MULTILINE
-        )
-        got2 = re.sub(r"^mercurial\.\w+\.(\w+): ", r"\1: ", got2, re.MULTILINE)
+        got2 = _excmsgre.sub(r"\1: \3", got2)
+        got2 = _excnamere.sub(r"\1: ", got2)
         return any(
             doctest.OutputChecker.check_output(self, w, g, optionflags)
             for w, g in [(want, got), (want2, got2)]
         )
 
 
+_finder = doctest.DocTestFinder()
+_checker = py3docchecker() if ispy3 else None
+
+
 def testmod(name, optionflags=0, testtarget=None):
     __import__(name)
     mod = sys.modules[name]
@@ -44,12 +52,9 @@ def testmod(name, optionflags=0, testtarget=None):
         mod = getattr(mod, testtarget)
 
     # minimal copy of doctest.testmod()
-    finder = doctest.DocTestFinder()
-    checker = None
-    if ispy3:
-        checker = py3docchecker()
-    runner = doctest.DocTestRunner(checker=checker, optionflags=optionflags)
-    for test in finder.find(mod, name):
+    # the runner keeps per module results for summarize(), so it is not shared
+    runner = doctest.DocTestRunner(checker=_checker, optionflags=optionflags)
+    for test in _finder.find(mod, name):
         runner.run(test)
     runner.summarize()
 
@@ -6,7 +6,6 @@
 
 from __future__ import absolute_import
 
-from edenscm.mercurial import pycompat
 from testutil.dott import feature, sh, testtmp  # noqa: F401
 
 
@@ -14,9 +13,12 @@ sh % "hg init repo"
 sh % "cd repo"
 sh % "touch foo"
 sh % "hg add foo"
-for i in range(12):
-    open("foo", "ab").write(b"foo-%s\n" % pycompat.encodeutf8(str(i)))
-    sh.hg("ci", "-m", "foo-%s" % i)
+with open("foo", "ab") as f:
+    for i in range(12):
+        f.write(b"foo-%d\n" % i)
+        # make the content visible to the commit below
+        f.flush()
+        sh.hg("ci", "-m", "foo-%s" % i)
 
 sh % "hg export -v -o 'foo-%nof%N.patch' 2:tip" == r"""
     exporting patches:
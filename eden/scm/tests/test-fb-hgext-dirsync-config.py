@@ -0,0 +1,202 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2.
+
+from __future__ import absolute_import
+
+import itertools
+import unittest
+
+import bindings
+import silenttestrunner
+from edenscm.hgext import dirsync
+
+
+def _parse(content):
+    return dirsync._parseconfigs(content, ())
+
+
+def _paths(maps):
+    """paths to look up: every mirror, the files in and next to them"""
+    components = set()
+    for dirs in maps.values():
+        for mirror in dirs:
+            components.update(c for c in mirror.split("/") if c)
+    components.update(["f", "other"])
+    paths = set()
+    for n in (1, 2, 3, 4):
+        for parts in itertools.product(sorted(components), repeat=n):
+            paths.add("/".join(parts))
+    return sorted(paths)
+
+
+class fakefilectx(object):
+    def __init__(self, data):
+        self._data = data
+
+    def data(self):
+        return self._data
+
+
+class fakeui(object):
+    def __init__(self, items):
+        self._items = items
+
+    def configitems(self, section):
+        assert section == "dirsync"
+        return list(self._items)
+
+
+class fakerepo(object):
+    def __init__(self, items):
+        self.ui = fakeui(items)
+
+
+class fakewctx(object):
+    def __init__(self, content, items=()):
+        self._content = content
+        self._repo = fakerepo(items)
+
+    def __getitem__(self, path):
+        if self._content is None:
+            raise KeyError(path)
+        return fakefilectx(self._content.encode("utf-8"))
+
+    def repo(self):
+        return self._repo
+
+
+class testdirsyncconfig(unittest.TestCase):
+    def assertTrieMatchesGetmirrors(self, maps):
+        trie = dirsync.getmirrortrie(maps)
+        for path in _paths(maps):
+            expected = dirsync.getmirrors(maps, path)
+            self.assertEqual(trie.lookup(path), expected, path)
+            srcmirror, mirrors = expected
+            dstmirrors = tuple(m for m in mirrors if m != srcmirror)
+            self.assertEqual(
+                trie.lookupdestinations(path),
+                (srcmirror, dstmirrors) if srcmirror else (None, ()),
+                path,
+            )
+
+    def assertPrefixMatcherMatchesTreematcher(self, maps):
+        matcher = dirsync.configstomatcher(maps)
+        self.assertIsInstance(matcher, dirsync._prefixmatcher)
+        mirrors = {m for dirs in maps.values() for m in dirs}
+        expected = bindings.pathmatcher.treematcher(
+            sorted("%s**" % m for m in mirrors)
+        )
+        for path in _paths(maps):
+            self.assertEqual(matcher.matches(path), expected.matches(path), path)
+
+    def testsimple(self):
+        maps = _parse("a.dir1 = dir1\na.dir2 = dir2/sub/\n")
+        self.assertEqual(list(maps.items()), [("a", ["dir1/", "dir2/sub/"])])
+        trie = dirsync.getmirrortrie(maps)
+        self.assertEqual(trie.lookup("dir1/f"), ("dir1/", ["dir1/", "dir2/sub/"]))
+        self.assertEqual(
+            trie.lookupdestinations("dir2/sub/x/f"), ("dir2/sub/", ("dir1/",))
+        )
+        self.assertEqual(trie.lookup("dir2/f"), (None, []))
+        self.assertEqual(trie.lookup("dir10/f"), (None, []))
+        self.assertTrieMatchesGetmirrors(maps)
+        self.assertPrefixMatcherMatchesTreematcher(maps)
+
+    def testoverlappingmirrors(self):
+        maps = _parse(
+            "\n".join(
+                [
+                    "inner.dir1 = a/b",
+                    "inner.dir2 = c",
+                    "outer.dir1 = a",
+                    "outer.dir2 = d",
+                    "nested.dir1 = d/e",
+                    "nested.dir2 = f",
+                ]
+            )
+        )
+        trie = dirsync.getmirrortrie(maps)
+        # The first rule in config order wins, not the longest one.
+        self.assertEqual(trie.lookup("a/b/f"), ("a/b/", ["a/b/", "c/"]))
+        self.assertEqual(trie.lookup("a/x"), ("a/", ["a/", "d/"]))
+        self.assertEqual(trie.lookup("d/e/f"), ("d/", ["a/", "d/"]))
+        self.assertTrieMatchesGetmirrors(maps)
+        self.assertPrefixMatcherMatchesTreematcher(maps)
+
+    def testexcluderules(self):
+        maps = _parse(
+            "\n".join(
+                [
+                    "p.dir1 = a",
+                    "exclude.p.dir1 = a/skip",
+                    "p.dir2 = b",
+                    "exclude.p.dir2 = b/skip",
+                    "q.dir1 = a/skip/again",
+                    "q.dir2 = c",
+                ]
+            )
+        )
+        trie = dirsync.getmirrortrie(maps)
+        self.assertEqual(trie.lookup("a/f"), ("a/", ["a/", "b/"]))
+        # Exclude rules win, even over rules for deeper directories.
+        self.assertEqual(trie.lookup("a/skip/f"), (None, []))
+        self.assertEqual(trie.lookup("a/skip/again/f"), (None, []))
+        self.assertEqual(trie.lookup("a/skipped"), ("a/", ["a/", "b/"]))
+        self.assertTrieMatchesGetmirrors(maps)
+
+    def testfilemirrors(self):
+        maps = _parse("p.file1 = a/file\np.file2 = b/file\n")
+        trie = dirsync.getmirrortrie(maps)
+        self.assertEqual(trie.lookupdestinations("a/file"), ("a/file/", ("b/file/",)))
+        self.assertEqual(trie.lookup("a/file2"), (None, []))
+        self.assertTrieMatchesGetmirrors(maps)
+        self.assertPrefixMatcherMatchesTreematcher(maps)
+
+    def testglobfallback(self):
+        maps = _parse("p.dir1 = a*\np.dir2 = b\n")
+        matcher = dirsync.configstomatcher(maps)
+        self.assertNotIsInstance(matcher, dirsync._prefixmatcher)
+        self.assertTrue(matcher.matches("abc/f"))
+        self.assertTrue(matcher.matches("b/f"))
+        self.assertFalse(matcher.matches("c/f"))
+
+    def testrootedpathfallback(self):
+        maps = _parse("p.dir1 = /a\np.dir2 = b\n")
+        matcher = dirsync.configstomatcher(maps)
+        self.assertNotIsInstance(matcher, dirsync._prefixmatcher)
+        expected = bindings.pathmatcher.treematcher(["/a/**", "b/**"])
+        for path in ["a/f", "b/f", "c/f"]:
+            self.assertEqual(matcher.matches(path), expected.matches(path), path)
+        self.assertTrieMatchesGetmirrors(maps)
+
+    def testconfigcache(self):
+        dirsync._configcache.clear()
+        first = dirsync._getcachedconfigs(fakewctx("p.dir1 = a\np.dir2 = b\n"))
+        self.assertEqual(list(first[0].items()), [("p", ["a/", "b/"])])
+
+        # The same content is served from the cache.
+        again = dirsync._getcachedconfigs(fakewctx("p.dir1 = a\np.dir2 = b\n"))
+        self.assertIs(again, first)
+
+        # Changing .hgdirsync invalidates it.
+        changed = dirsync._getcachedconfigs(fakewctx("p.dir1 = a\np.dir2 = c\n"))
+        self.assertIsNot(changed, first)
+        self.assertEqual(list(changed[0].items()), [("p", ["a/", "c/"])])
+        self.assertEqual(changed[2].lookup("c/f"), ("c/", ["a/", "c/"]))
+        self.assertEqual(changed[2].lookup("b/f"), (None, []))
+
+        # So does changing the [dirsync] config.
+        withui = dirsync._getcachedconfigs(
+            fakewctx("p.dir1 = a\np.dir2 = c\n", [("q.dir1", "x"), ("q.dir2", "y")])
+        )
+        self.assertIsNot(withui, changed)
+        self.assertEqual(withui[2].lookup("x/f"), ("x/", ["x/", "y/"]))
+
+        # No .hgdirsync and no config means nothing to sync.
+        self.assertEqual(dirsync._getcachedconfigs(fakewctx(None))[1:], (None, None))
+
+
+if __name__ == "__main__":
+    silenttestrunner.main(__name__)
@@ -0,0 +1,71 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2.
+
+from __future__ import absolute_import
+
+import unittest
+
+import silenttestrunner
+from edenscm.hgext.fastannotate import protocol
+from edenscm.mercurial import error
+
+
+def _parse(payload):
+    return {k: bytes(v) for k, v in protocol._parseresponse(payload).items()}
+
+
+class testparseresponse(unittest.TestCase):
+    def testempty(self):
+        self.assertEqual(_parse(b""), {})
+
+    def testfiles(self):
+        payload = (
+            b"fastannotate/default/a.m\x003\x00abc"
+            b"fastannotate/default/a.l\x005\x00\x00\x01\x02\x03\x04"
+            b"fastannotate/default/empty.l\x000\x00"
+        )
+        self.assertEqual(
+            _parse(payload),
+            {
+                "fastannotate/default/a.m": b"abc",
+                "fastannotate/default/a.l": b"\x00\x01\x02\x03\x04",
+                "fastannotate/default/empty.l": b"",
+            },
+        )
+
+    def testcontentisaview(self):
+        result = protocol._parseresponse(b"a\x003\x00abc")
+        self.assertIsInstance(result["a"], memoryview)
+
+    def testmissingterminator(self):
+        for payload in [
+            b"fastannotate/a.m",
+            b"fastannotate/a.m\x003",
+            b"fastannotate/a.m\x003\x00abcfastannotate/a.l",
+            b"fastannotate/a.m\x003\x00abcfastannotate/a.l\x002",
+        ]:
+            with self.assertRaises(error.ResponseError, msg=payload):
+                protocol._parseresponse(payload)
+
+    def testbadsize(self):
+        for payload in [
+            b"fastannotate/a.m\x00\x00",
+            b"fastannotate/a.m\x00x\x00abc",
+            b"fastannotate/a.m\x00-1\x00abc",
+        ]:
+            with self.assertRaises(error.ResponseError, msg=payload):
+                protocol._parseresponse(payload)
+
+    def testtruncated(self):
+        for payload in [
+            b"fastannotate/a.m\x004\x00abc",
+            b"fastannotate/a.m\x003\x00abcfastannotate/a.l\x0010\x00abc",
+        ]:
+            with self.assertRaises(error.ResponseError, msg=payload):
+                protocol._parseresponse(payload)
+
+
+if __name__ == "__main__":
+    silenttestrunner.main(__name__)
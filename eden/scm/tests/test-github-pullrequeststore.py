@@ -0,0 +1,67 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2.
+
+from __future__ import absolute_import
+
+import json
+import unittest
+
+import silenttestrunner
+from edenscm.hgext.github.pullrequeststore import (
+    _RECORD,
+    decode_pr_data,
+    encode_pr_data,
+)
+from edenscm.mercurial.node import bin
+
+
+def _prdata(version=1):
+    return {
+        "version": version,
+        "commits": {
+            "11" * 20: {"owner": "facebook", "name": "sapling", "number": 1},
+            "22" * 20: {"owner": "facebook", "name": "sapling", "number": 2},
+            "33" * 20: {"owner": "someone", "name": "fork", "number": 4294967295},
+        },
+    }
+
+
+def _version2blob(commits):
+    owners = ["facebook", "someone"]
+    names = ["sapling", "fork"]
+    header = {"version": 2, "owners": owners, "names": names}
+    records = [
+        _RECORD.pack(
+            bin(node), owners.index(pr["owner"]), names.index(pr["name"]), pr["number"]
+        )
+        for node, pr in commits.items()
+    ]
+    return json.dumps(header).encode("utf8") + b"\0" + b"".join(records)
+
+
+class PullRequestStoreEncodingTest(unittest.TestCase):
+    def testversion1roundtrip(self):
+        blob = encode_pr_data(_prdata())
+        self.assertEqual(decode_pr_data(blob), _prdata())
+
+    def testversion1isplainjson(self):
+        # Older clients decode the blob with json.loads().
+        blob = encode_pr_data(_prdata(version=2))
+        self.assertEqual(json.loads(blob), _prdata())
+
+    def testversion2decode(self):
+        blob = _version2blob(_prdata()["commits"])
+        self.assertEqual(decode_pr_data(blob), _prdata(version=2))
+
+    def testempty(self):
+        empty = {"version": 1, "commits": {}}
+        self.assertEqual(decode_pr_data(encode_pr_data(empty)), empty)
+        self.assertEqual(
+            decode_pr_data(_version2blob({})), {"version": 2, "commits": {}}
+        )
+
+
+if __name__ == "__main__":
+    silenttestrunner.main(__name__)
@@ -184,10 +184,7 @@ class testrustlock(unittest.TestCase):
             lock.rustlock(self.vfs, name, timeout=0)
 
     def assertNotLocked(self, name):
-        try:
-            lock.rustlock(self.vfs, name, timeout=0).release()
-        except Exception as err:
-            self.assertTrue(False, str(err))
+        self.assertFalse(lock.rustislocked(self.vfs, name))
 
 
 if __name__ == "__main__":
@@ -8,7 +8,9 @@
 import os
 import unittest
 from pathlib import Path
-from typing import Callable, TypeVar
+from typing import Callable, Optional, TypeVar
+
+from eden.test_support.temporary_directory import TempFileManager
 
 from .repo import Repo
 from .server import LocalServer, MononokeServer, Server
@@ -17,13 +19,58 @@ from .workingcopy import WorkingCopy
 
 
 class BaseTest(unittest.TestCase):
+    # Starting Mononoke is slow, so a single server is shared by all the tests
+    # in a class. Each setUp takes a fresh repo slot on it. Once the slots run
+    # out, e.g. because tests are retried, tests get a server of their own.
+    # Classes that override new_server() always use it instead.
+    _shared_server: Optional[MononokeServer] = None
+    _shared_temp_mgr: Optional[TempFileManager] = None
+    _next_repoid: int = 0
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        if (
+            os.environ.get("USE_MONONOKE", False)
+            and cls.new_server is BaseTest.new_server
+        ):
+            # The server's directories must outlive the per-test temp dirs.
+            test_globals.setup()
+            temp_mgr = test_globals.temp_mgr
+            repo_count = len(unittest.TestLoader().getTestCaseNames(cls))
+            try:
+                cls._shared_server = MononokeServer(repo_count=max(repo_count, 1))
+            except BaseException:
+                temp_mgr.cleanup()
+                raise
+            cls._shared_temp_mgr = temp_mgr
+            cls._next_repoid = 0
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        if cls._shared_server is not None:
+            cls._shared_server.cleanup()
+            cls._shared_server = None
+        if cls._shared_temp_mgr is not None:
+            cls._shared_temp_mgr.cleanup()
+            cls._shared_temp_mgr = None
+        super().tearDownClass()
+
     def setUp(self) -> None:
         test_globals.setup()
         self.addCleanup(test_globals.cleanup)
-        self.server = self.new_server()
-        self.addCleanup(self.server.cleanup)
+        cls = type(self)
+        shared = cls._shared_server
+        if shared is not None and cls._next_repoid < shared.repo_count:
+            self.server = shared
+            repoid = cls._next_repoid
+            cls._next_repoid += 1
+        else:
+            self.server = self.new_server()
+            self.addCleanup(self.server.cleanup)
+            repoid = 0
         self._add_production_configs(Path(test_globals.env["HGRCPATH"]))
-        self.repo = self.server.clone()
+        self.repo = self.server.clone(repoid)
 
     def _add_production_configs(self, hgrc: Path) -> None:
         # Most production configs should be loaded via dynamicconfig. The ones
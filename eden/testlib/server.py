@@ -6,11 +6,15 @@
 # pyre-strict
 from __future__ import annotations
 
+import atexit
 import os
+import shutil
 import subprocess
+import tempfile
+import threading
 import time
 from pathlib import Path
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 
 import requests
 
@@ -103,9 +107,15 @@ def _start(repo_count) -> Tuple[subprocess.Popen[bytes], str, str]:
     config_path = tjoin("mononoke-config")
 
     _setup_mononoke_configs(config_path)
-    _setup_configerator(configerator_path)
+    template_dir = _config_template(repo_count)
+    _link_tree(os.path.join(template_dir, "configerator"), configerator_path)
     for i in range(repo_count):
-        _setup_repo(config_path, i)
+        for subdir in ("repos", "repo_definitions"):
+            path = os.path.join(subdir, f"repo{i}")
+            _link_tree(
+                os.path.join(template_dir, "config", path),
+                os.path.join(config_path, path),
+            )
 
     process = subprocess.Popen(
         [
@@ -167,7 +177,9 @@ def _wait(
 ) -> Tuple[str, str]:
     start = time.time()
     while not os.path.exists(addr_file) and (time.time() - start < 60):
-        time.sleep(0.5)
+        # A short interval, so the server is picked up soon after it writes
+        # the address file. An exists() check is cheap.
+        time.sleep(0.05)
         state = process.poll()
         if state is not None:
             raise Exception(
@@ -195,6 +207,39 @@ def _wait(
     return port
 
 
+# Configs that do not depend on the server instance are written once per
+# process into a template directory, and hardlinked into the config
+# directories of each server. The servers only read them.
+_template_lock = threading.Lock()
+_template_dir: Optional[str] = None
+_template_repo_count: int = 0
+
+
+def _config_template(repo_count: int) -> str:
+    global _template_dir, _template_repo_count
+    with _template_lock:
+        if _template_dir is None:
+            template_dir = tempfile.mkdtemp(prefix="mononoke-config-template")
+            atexit.register(shutil.rmtree, template_dir, True)
+            _setup_configerator(os.path.join(template_dir, "configerator"))
+            _template_dir = template_dir
+        for i in range(_template_repo_count, repo_count):
+            _setup_repo(os.path.join(_template_dir, "config"), i)
+        _template_repo_count = max(_template_repo_count, repo_count)
+        return _template_dir
+
+
+def _link_tree(src: str, dst: str) -> None:
+    def link(src: str, dst: str) -> None:
+        try:
+            os.link(src, dst)
+        except OSError:
+            # For example, src and dst are on different filesystems.
+            shutil.copy2(src, dst)
+
+    shutil.copytree(src, dst, copy_function=link, dirs_exist_ok=True)
+
+
 def _setup_mononoke_configs(config_dir: str) -> None:
     def write(path: str, content: str) -> None:
         path = os.path.join(config_dir, path)
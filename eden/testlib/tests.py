@@ -6,7 +6,6 @@
 # pyre-strict
 
 import os
-from pathlib import Path
 
 from .base import BaseTest, hgtest
 from .repo import Repo
@@ -22,19 +21,12 @@ class TestLibTests(BaseTest):
 
     @hgtest
     def test_working_copy_edits(self, repo: Repo, wc: WorkingCopy) -> None:
-        def join(path: PathLike) -> Path:
-            # pyre-fixme[7]: Expected `Path` but got `str`.
-            # pyre-fixme[6]: For 2nd param expected `Union[PathLike[str], str]` but
-            #  got `Union[Path, File, str]`.
-            return os.path.join(wc.root, path)
-
         def exists(path: PathLike) -> bool:
-            # pyre-fixme[6]: For 2nd param expected `Union[PathLike[str], str]` but
-            #  got `Union[Path, File, str]`.
-            return os.path.exists(os.path.join(wc.root, path))
+            return os.path.exists(wc.join(path))
 
         def read(path: PathLike) -> str:
-            return open(join(path)).read()
+            with open(wc.join(path)) as f:
+                return f.read()
 
         # Test auto-generating path and content, with hg add
         file = wc.file()
@@ -81,7 +81,8 @@ class WorkingCopy:
         if path is None:
             path = default_path
         if content is None:
-            content = str(path)
+            # Already bytes, so File.write doesn't need to encode it.
+            content = os.fsencode(str(path))
 
         file = self[path]
         file.write(content)
@@ -150,15 +151,11 @@ overrides = {{}}
 
 @contextmanager
 def override_environ(values: Dict[str, str]) -> Generator[None, None, None]:
-    backup = {}
-    for key, value in values.items():
-        old = os.environ.get(key, None)
-        if old is not None:
-            backup[key] = old
-        os.environ[key] = value
-    yield
-    for key in values.keys():
-        os.environ.pop(key)
-        old = backup.get(key, None)
-        if old is not None:
-            os.environ[key] = old
+    backup = {key: os.environ[key] for key in values if key in os.environ}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for key in values:
+            del os.environ[key]
+        os.environ.update(backup)